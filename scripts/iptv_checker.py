@@ -4,15 +4,20 @@ IPTV源检测脚本 - 修正版，输出格式优化
 """
 
 import os
-import re
 import json
 import time
-import requests
-import subprocess
-import concurrent.futures
+import asyncio
+import functools
+import aiohttp
 from datetime import datetime
-from collections import defaultdict
-from typing import Dict, List, Set, Optional
+from itertools import zip_longest
+from collections import defaultdict, deque
+from typing import Dict, List, Set, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时退回标准库json
+    orjson = None
 
 # ===============================
 # 配置区
@@ -33,6 +38,9 @@ TARGETS = [
     ("河北", "电信", "239.254.200.174:6000", "hectcc"),
 ]
 
+# (省份, 运营商) -> (组播地址, 英文简称)
+TARGET_MAP = {(p, i): (addr, code) for p, i, addr, code in TARGETS}
+
 # GitHub仓库列表
 REPOS = [
     "kakaxi-1/zubo",
@@ -54,106 +62,492 @@ REPOS = [
 # 测试配置
 REQUEST_TIMEOUT = 10
 TEST_TIMEOUT = 20
-MAX_WORKERS = 10
-MAX_IPS_PER_TARGET = 500
+CONNECT_TIMEOUT = 3
+STALL_TIMEOUT = 3  # 连接成功后超过该秒数收不到数据即判为不可播放
+PROBE_BYTES = 16 * 1024  # 直接读取流检测时读取的字节数
+TS_PACKET_SIZE = 188
+# 每个组合同时进行的流检测数（也即ffprobe后备进程数上限），按可用CPU数放大（至少16个）；
+# 窗口有限，提前结束时少做无用检测
+try:
+    MAX_WORKERS = max(16, 4 * len(os.sched_getaffinity(0)))
+except AttributeError:  # 非Linux平台没有sched_getaffinity
+    MAX_WORKERS = max(16, 4 * (os.cpu_count() or 1))
+MAX_CONCURRENCY = 200
+GITHUB_MAX_ACTIVE = 8  # 同时进行的GitHub API请求数
+RATE_LIMIT_MAX_WAIT = 60  # 速率限制恢复时间在该秒数内则等待，否则放弃
+GITHUB_RETRIES = 2  # GitHub请求遇到网络错误或5xx时的重试次数（不用于测试IP）
+RETRY_BACKOFF = 0.3  # 重试前等待 RETRY_BACKOFF * 2^n 秒
+TARGET_HITS = 8  # 每个组合找到这么多可播放源即停止测试，再从中取延迟最低的前2名
+PROGRESS_INTERVAL = 1.0  # 进度输出的最小间隔（秒）
 OUTPUT_FILE = "iptv.json"
+CACHE_FILE = ".http_cache.json"
+BLOB_CACHE_FILE = ".blob_cache.json"
+PROBE_CACHE_FILE = ".probe_cache.json"
+# 连续PROBE_SKIP_FAILS次运行TCP不通的IP，下一次运行跳过不测；
+# 两次失败间隔超过PROBE_CACHE_TTL则不算连续（每日运行时最多只跳过一次）
+PROBE_SKIP_FAILS = 2
+PROBE_CACHE_TTL = 36 * 3600
+
+# 按URL缓存的ETag及对应数据，用于条件请求
+_http_cache: Dict[str, Dict] = {}
+# 本次运行请求过的URL，保存时只保留这些缓存条目
+_http_cache_used: Set[str] = set()
+
+# 文件内容(blob sha) -> 提取出的IP；sha未变的文件无需再请求
+_blob_cache: Dict[str, List[str]] = {}
+# 本次运行用到的sha，保存时只保留这些条目
+_blob_cache_used: Set[str] = set()
+# 本次运行中按sha去重的下载任务
+_blob_downloads: Dict[str, asyncio.Task] = {}
+
+# TCP连接失败的IP -> [连续失败次数, 最近失败时间戳]
+_probe_failures: Dict[str, List[float]] = {}
+
+# ===============================
+# JSON读写函数
+# ===============================
+
+def json_loads(data: bytes):
+    """解析JSON字节串"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dump_file(path: str, obj, indent: bool = False):
+    """将对象以UTF-8 JSON写入文件"""
+    if orjson:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2 if indent else None)
+
+# ===============================
+# 缓存函数
+# ===============================
+
+def read_cache_file(path: str) -> Dict:
+    """读取JSON缓存文件，不存在或损坏时返回空字典"""
+    try:
+        with open(path, 'rb') as f:
+            data = json_loads(f.read())
+        if isinstance(data, dict):
+            return data
+        print(f"  警告: 缓存 {path} 格式不正确，已忽略")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"  警告: 读取缓存 {path} 失败: {e}")
+    return {}
+
+def write_cache_file(path: str, data: Dict):
+    """将缓存写回磁盘"""
+    try:
+        json_dump_file(path, data)
+    except Exception as e:
+        print(f"  警告: 写入缓存 {path} 失败: {e}")
+
+def load_caches():
+    """读取上次运行保存的缓存，丢弃格式不正确和过期的条目"""
+    _http_cache.update(
+        (url, entry) for url, entry in read_cache_file(CACHE_FILE).items()
+        if isinstance(entry, dict) and isinstance(entry.get('etag'), str)
+        and isinstance(entry.get('data'), list)
+    )
+    _blob_cache.update(
+        (sha, ips) for sha, ips in read_cache_file(BLOB_CACHE_FILE).items()
+        if isinstance(ips, list) and all(isinstance(ip, str) for ip in ips)
+    )
+    
+    now = time.time()
+    _probe_failures.update(
+        (ip, entry) for ip, entry in read_cache_file(PROBE_CACHE_FILE).items()
+        if isinstance(entry, list) and len(entry) == 2
+        and all(isinstance(x, (int, float)) for x in entry)
+        and now - entry[1] < PROBE_CACHE_TTL
+    )
+
+def save_caches():
+    """保存缓存；已从仓库移除的文件不再请求，其ETag条目随之丢弃"""
+    write_cache_file(CACHE_FILE, {
+        url: entry for url, entry in _http_cache.items() if url in _http_cache_used
+    })
+    write_cache_file(BLOB_CACHE_FILE, {
+        sha: ips for sha, ips in _blob_cache.items() if sha in _blob_cache_used
+    })
+    write_cache_file(PROBE_CACHE_FILE, _probe_failures)
+
+def conditional_headers(url: str, headers: Optional[Dict] = None) -> Dict:
+    """为已缓存的URL附加If-None-Match请求头"""
+    headers = dict(headers or {})
+    _http_cache_used.add(url)
+    cached = _http_cache.get(url)
+    if cached:
+        headers['If-None-Match'] = cached['etag']
+    return headers
+
+def store_cache(url: str, headers, data):
+    """响应带ETag时缓存解析后的数据"""
+    etag = headers.get('ETag')
+    if etag:
+        _http_cache[url] = {'etag': etag, 'data': data}
 
 # ===============================
 # GitHub API函数
 # ===============================
 
-def fetch_repo_files(repo: str) -> Optional[List[Dict]]:
-    """获取仓库ip目录下的文件列表"""
-    api_url = f"https://api.github.com/repos/{repo}/contents/ip"
-    headers = {'User-Agent': 'IPTV-Scanner'}
+def create_session() -> aiohttp.ClientSession:
+    """创建整个运行期间复用的HTTP会话"""
+    # 同一主机的连接保持keep-alive复用，DNS结果缓存到运行结束
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONCURRENCY,
+        limit_per_host=20,
+        ttl_dns_cache=600,
+        keepalive_timeout=60
+    )
+    return aiohttp.ClientSession(connector=connector, headers={'User-Agent': 'IPTV-Scanner'})
+
+async def with_retries(func, *args):
+    """调用func(*args)，遇到网络错误或5xx时按指数退避重试，最后一次的异常照常抛出"""
+    for attempt in range(GITHUB_RETRIES):
+        try:
+            return await func(*args)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+    return await func(*args)
+
+class RateLimitError(Exception):
+    """GitHub API速率限制已用尽"""
     
-    if 'GITHUB_TOKEN' in os.environ:
-        headers['Authorization'] = f"token {os.environ['GITHUB_TOKEN']}"
+    def __init__(self, reset_at: float):
+        super().__init__(f"速率限制将于 {datetime.fromtimestamp(reset_at):%H:%M:%S} 恢复")
+        self.reset_at = reset_at
+
+class GitHubClient:
+    """GitHub API客户端：限制同时进行的请求数，并根据速率限制响应头提前等待"""
+    
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+        self.headers = {}
+        # 令牌只发给GitHub API，不放进会话默认头，避免带到测试IP上
+        if 'GITHUB_TOKEN' in os.environ:
+            self.headers['Authorization'] = f"token {os.environ['GITHUB_TOKEN']}"
+        
+        self._semaphore = asyncio.Semaphore(GITHUB_MAX_ACTIVE)
+        self._remaining: Optional[int] = None
+        self._reset_at = 0.0
+    
+    async def get(self, url: str, log: List[str], headers: Optional[Dict] = None) -> Tuple[int, Dict, bytes]:
+        """发送GET请求，返回(状态码, 响应头, 响应体)；网络错误或5xx时重试，提示信息追加到log"""
+        return await with_retries(self._get_once, url, log, headers)
+    
+    async def _get_once(self, url: str, log: List[str], headers: Optional[Dict]) -> Tuple[int, Dict, bytes]:
+        async with self._semaphore:
+            await self._wait_for_rate_limit(log)
+            
+            async with self.session.get(url, headers={**self.headers, **(headers or {})},
+                                        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as resp:
+                self._update_rate_limit(resp.headers)
+                body = await resp.read()
+            
+            if resp.status in (403, 429) and self._remaining == 0:
+                raise RateLimitError(self._reset_at)
+            if resp.status >= 500:
+                resp.raise_for_status()
+            return resp.status, resp.headers, body
+    
+    def _update_rate_limit(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            self._remaining = int(remaining)
+            self._reset_at = float(reset)
+    
+    async def _wait_for_rate_limit(self, log: List[str]):
+        # 剩余次数即将用尽时，等待限制恢复后再发请求
+        if self._remaining is None or self._remaining >= 2:
+            return
+        
+        wait = self._reset_at - time.time()
+        if wait > RATE_LIMIT_MAX_WAIT:
+            raise RateLimitError(self._reset_at)
+        if wait > 0:
+            log.append(f"  GitHub API剩余次数不足，等待 {wait:.0f} 秒")
+            await asyncio.sleep(wait)
+        self._remaining = None
+
+async def fetch_repo_files(client: GitHubClient, repo: str, log: List[str]) -> Optional[List[Dict]]:
+    """获取仓库ip目录下的文件列表，提示信息追加到log"""
+    # contents接口不分页（单个目录最多返回1000个文件，没有Link响应头），一次请求即可
+    api_url = f"https://api.github.com/repos/{repo}/contents/ip"
     
     try:
-        resp = requests.get(api_url, headers=headers, timeout=REQUEST_TIMEOUT)
-        if resp.status_code == 200:
-            return resp.json()
-        elif resp.status_code == 403:
-            print(f"  警告: {repo} 访问被限制")
+        status, headers, body = await client.get(api_url, log, headers=conditional_headers(api_url))
+        if status == 304:
+            return _http_cache[api_url]['data']
+        elif status == 200:
+            # 只保留后续用到的字段，缓存文件保持精简
+            files = [
+                {k: f.get(k) for k in ('name', 'type', 'download_url', 'sha')}
+                for f in json_loads(body)
+            ]
+            store_cache(api_url, headers, files)
+            return files
+        elif status == 403:
+            log.append(f"  警告: {repo} 访问被限制")
         else:
-            print(f"  警告: {repo} 返回状态码 {resp.status_code}")
+            log.append(f"  警告: {repo} 返回状态码 {status}")
+    except RateLimitError as e:
+        log.append(f"  警告: {repo} 访问被限制，{e}")
     except Exception as e:
-        print(f"  错误: 获取 {repo} 失败: {e}")
+        log.append(f"  错误: 获取 {repo} 失败: {e}")
     
     return None
 
-def is_target_match(filename: str, province: str, isp: str) -> bool:
-    """检查文件名是否匹配目标省份和运营商"""
-    name = filename.replace('.txt', '').replace(' ', '')
-    province_in_name = province in name
-    isp_in_name = isp in name
-    return province_in_name and isp_in_name
+def is_ipv4_port(line: bytes) -> bool:
+    """校验一行是否为 IPv4:端口 格式（不用正则，逐段检查数字）"""
+    # "1.1.1.1:1" 到 "255.255.255.255:65535" 的长度范围
+    if not 9 <= len(line) <= 21 or line.count(b'.') != 3:
+        return False
+    host, _, port = line.partition(b':')
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        return False
+    parts = host.split(b'.')
+    return len(parts) == 4 and all(
+        p.isdigit() and len(p) <= 3 and int(p) < 256 for p in parts
+    )
 
-def extract_ips_from_url(download_url: str) -> Set[str]:
-    """从下载链接提取IP:端口，如果超过20个，只取最后20个"""
-    ips = set()
+@functools.lru_cache(maxsize=4096)
+def match_target(filename: str) -> Optional[Tuple[str, str]]:
+    """检查文件名匹配哪个目标省份和运营商，返回(省份, 运营商)"""
+    name = filename.removesuffix('.txt').replace(' ', '')
+    for province, isp in TARGET_MAP:
+        if province in name and isp in name:
+            return province, isp
+    return None
+
+async def extract_ips_from_url(session: aiohttp.ClientSession, download_url: str, log: List[str]) -> Set[str]:
+    """从下载链接提取IP:端口，如果超过20个，只取最后20个；提示信息追加到log"""
     try:
-        resp = requests.get(download_url, timeout=REQUEST_TIMEOUT)
-        if resp.status_code == 200:
-            lines = resp.text.split('\n')
-            valid_ips = []
+        return await with_retries(fetch_ip_list, session, download_url, log)
+    except Exception as e:
+        log.append(f"    下载失败: {e}")
+        return set()
+
+async def fetch_ip_list(session: aiohttp.ClientSession, download_url: str, log: List[str]) -> Set[str]:
+    """下载一次文件并提取IP，网络错误或5xx时抛出异常"""
+    ips = set()
+    async with session.get(download_url, headers=conditional_headers(download_url),
+                           timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as resp:
+        if resp.status == 304:
+            ips.update(_http_cache[download_url]['data'])
+        elif resp.status == 200:
+            # 逐行读取响应，只保留最后20个有效IP，不缓存整个文件
+            valid_ips = deque(maxlen=20)
+            total = 0
             
             # 收集所有有效的IP
-            for line in lines:
+            async for line in resp.content:
                 line = line.strip()
-                if line and not line.startswith('#'):
-                    if re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d+$', line):
-                        valid_ips.append(line)
+                if line and line[:1] != b'#' and is_ipv4_port(line):
+                    valid_ips.append(line.decode('ascii'))
+                    total += 1
             
-            # 检查IP数量并处理
-            if len(valid_ips) > 20:
-                print(f"    (从 {len(valid_ips)} 个IP中取了最后20个)")
-                valid_ips = valid_ips[-20:]  # 只取最后20个
+            # 超过20个时只取了最后20个
+            if total > 20:
+                log.append(f"    (从 {total} 个IP中取了最后20个)")
             # 如果正好20个或更少，不显示提示
             
             # 添加到集合中（自动去重）
             ips.update(valid_ips)
-            
-    except Exception as e:
-        print(f"    下载失败: {e}")
+            store_cache(download_url, resp.headers, list(valid_ips))
+        elif resp.status >= 500:
+            resp.raise_for_status()
     
     return ips
 
+async def download_ips(session: aiohttp.ClientSession, file_info: Dict, log: List[str]) -> Set[str]:
+    """下载文件并提取IP
+    
+    以文件内容(blob sha)为键缓存结果：sha已知的文件不再请求，
+    互为镜像的仓库中内容相同的文件在本次运行中也只下载一次
+    """
+    sha = file_info.get('sha')
+    if not sha:
+        return await extract_ips_from_url(session, file_info['download_url'], log)
+    
+    _blob_cache_used.add(sha)
+    if sha in _blob_cache:
+        log.append("    (文件内容未变化，使用缓存的IP)")
+        return set(_blob_cache[sha])
+    
+    task = _blob_downloads.get(sha)
+    if task is None:
+        task = asyncio.ensure_future(extract_ips_from_url(session, file_info['download_url'], log))
+        _blob_downloads[sha] = task
+    else:
+        log.append("    (文件内容与其他仓库相同，复用下载结果)")
+    
+    ips = await task
+    if ips:
+        # 下载失败时返回空集合，不缓存
+        _blob_cache[sha] = sorted(ips)
+    return set(ips)
+
+async def process_repo(client: GitHubClient, repo: str) -> Dict[Tuple[str, str], Set[str]]:
+    """处理单个仓库：获取文件列表，并发下载匹配目标的IP文件，按(省份, 运营商)汇总"""
+    # 各仓库并发处理，日志先缓存，处理完后一次性输出，避免相互穿插
+    log = [f"\n处理仓库: {repo}"]
+    files = await fetch_repo_files(client, repo, log)
+    
+    if not files:
+        print("\n".join(log))
+        return {}
+    
+    txt_files = [f for f in files if f['type'] == 'file' and f['name'].endswith('.txt')]
+    matches = []
+    
+    for file_info in txt_files:
+        key = match_target(file_info['name'])
+        if key:
+            matches.append((file_info, key))
+    
+    file_logs = [[] for _ in matches]
+    ip_sets = await asyncio.gather(
+        *(download_ips(client.session, file_info, file_log)
+          for (file_info, _), file_log in zip(matches, file_logs))
+    )
+    
+    # 同一组合的多个文件先收集起来，最后一次性合并
+    pending = defaultdict(list)
+    for (file_info, key), ips, file_log in zip(matches, ip_sets, file_logs):
+        log.append(f"  ✅ 匹配到: {file_info['name']} -> {key[0]}{key[1]}")
+        log.extend(file_log)
+        if ips:
+            log.append(f"    提取到 {len(ips)} 个IP")
+            pending[key].append(ips)
+    
+    print("\n".join(log))
+    return {key: set().union(*parts) for key, parts in pending.items()}
+
 # ===============================
 # 测速函数 - 修改为第一个脚本的逻辑
 # ===============================
 
-def check_stream(url: str, timeout: int = 5) -> bool:
+async def tcp_probe(ip_port: str) -> Tuple[bool, float]:
+    """TCP握手探测端口是否开放，返回(是否连通, 连接耗时ms)"""
+    host, _, port = ip_port.rpartition(':')
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, int(port)), timeout=CONNECT_TIMEOUT
+        )
+    except Exception:
+        return False, 0.0
+    
+    latency = loop.time() - start_time
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return True, round(latency * 1000, 2)
+
+def has_ts_sync(data: bytes) -> bool:
+    """检查数据中是否有连续3个间隔188字节的MPEG-TS同步字节0x47"""
+    i = data.find(0x47)
+    while 0 <= i < len(data) - 2 * TS_PACKET_SIZE:
+        if data[i + TS_PACKET_SIZE] == 0x47 and data[i + 2 * TS_PACKET_SIZE] == 0x47:
+            return True
+        i = data.find(0x47, i + 1)
+    return False
+
+async def check_stream_native(session: aiohttp.ClientSession, url: str,
+                              timeout: int = 5) -> Tuple[Optional[bool], float]:
+    """直接读取流的前PROBE_BYTES字节，判断是否为MPEG-TS流
+    
+    返回(检测结果, 首字节耗时秒数)；收到数据但不是TS格式，或响应无法被aiohttp解析
+    （如ICY状态行、不规范的响应头）时结果为None，交给ffprobe判断
+    """
+    start_time = time.time()
+    first_byte_time = 0.0
+    
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout, sock_read=STALL_TIMEOUT)) as resp:
+            if resp.status >= 400:
+                return False, 0.0
+            
+            try:
+                buf = bytearray()
+                while len(buf) < PROBE_BYTES:
+                    chunk = await resp.content.read(PROBE_BYTES - len(buf))
+                    if not chunk:
+                        break
+                    if not buf:
+                        first_byte_time = time.time() - start_time
+                    buf += chunk
+            finally:
+                # 直播流不会自行结束，读够后直接关闭连接
+                resp.close()
+    except (aiohttp.ClientResponseError, aiohttp.ServerDisconnectedError):
+        # 服务器有回应但格式不规范，ffmpeg的HTTP实现更宽松，交给ffprobe
+        return None, 0.0
+    except Exception:
+        return False, 0.0
+    
+    if not buf:
+        return False, 0.0
+    return (True if has_ts_sync(buf) else None), first_byte_time
+
+async def check_stream(url: str, timeout: int = 5) -> bool:
     """检查流是否可播放，使用ffprobe检测（第一个脚本的逻辑）"""
     try:
-        result = subprocess.run(
-            ["ffprobe", "-v", "error", "-show_streams", "-i", url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=timeout + 2
+        proc = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error",
+            # 返回200却不发数据的服务器不必等满整个超时
+            "-rw_timeout", str(STALL_TIMEOUT * 1_000_000),
+            # 只需要流信息：单线程，最多分析1秒/500KB数据
+            "-threads", "1",
+            "-analyzeduration", "1000000",
+            "-probesize", "500000",
+            "-show_streams", "-i", url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL  # 错误输出不使用，无需缓存
         )
-        return b"codec_type" in result.stdout
     except Exception:
         return False
+    
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout + 2)
+        return b"codec_type" in stdout
+    except Exception:
+        return False
+    finally:
+        # 超时或任务被取消时结束ffprobe进程，避免残留
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
 
-def test_stream_playable(ip_port: str, multicast_addr: str) -> Optional[Dict]:
-    """测试流媒体是否可播放（使用第一个脚本的逻辑）"""
+async def test_stream_playable(session: aiohttp.ClientSession, ip_port: str, multicast_addr: str) -> Optional[Dict]:
+    """测试流媒体是否可播放，优先直接读取流检测，无法判断时再用ffprobe"""
     test_url = f"http://{ip_port}/rtp/{multicast_addr}"
     
     try:
-        start_time = time.time()
-        
-        # 使用第一个脚本的ffprobe检测逻辑
-        is_playable = check_stream(test_url, timeout=TEST_TIMEOUT)
+        # 单次GET完成检测，延迟取首字节到达时间
+        is_playable, latency = await check_stream_native(session, test_url, timeout=TEST_TIMEOUT)
         
-        download_time = time.time() - start_time
+        if is_playable is None:
+            # 有数据但不是TS，用ffprobe进一步确认是否可播放；
+            # 延迟仍取上面GET的首字节时间，与TS源的排序口径一致
+            is_playable = await check_stream(test_url, timeout=TEST_TIMEOUT)
         
         if is_playable:
             return {
                 'ip_port': ip_port,
                 'playable': True,
-                'latency_ms': round(download_time * 1000, 2),
+                'latency_ms': round(latency * 1000, 2),
                 'test_url': test_url
             }
         else:
@@ -161,32 +555,92 @@ def test_stream_playable(ip_port: str, multicast_addr: str) -> Optional[Dict]:
     except Exception:
         return None
 
-def complete_speed_test_workflow(ip_list: List[str], multicast_addr: str) -> List[Dict]:
+def group_by_subnet(ip_list: List[str]) -> List[List[str]]:
+    """按/24网段对IP分组"""
+    subnets = defaultdict(list)
+    for ip in ip_list:
+        subnets[ip.rsplit('.', 1)[0]].append(ip)
+    return list(subnets.values())
+
+def interleave_subnets(subnets: List[List[str]]) -> List[str]:
+    """各网段轮流取IP，合并为一个列表"""
+    return [ip for group in zip_longest(*subnets) for ip in group if ip]
+
+async def find_reachable_ips(ip_list: List[str]) -> Set[str]:
+    """TCP握手筛选端口开放的IP，用于过滤掉不必启动ffprobe的IP"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    
+    async def connect(ip: str) -> Tuple[bool, float]:
+        async with semaphore:
+            return await tcp_probe(ip)
+    
+    # 连续多次不通的IP本次跳过；跳过后重新计数，下次运行会再测试
+    skipped = {ip for ip in ip_list if _probe_failures.get(ip, [0])[0] >= PROBE_SKIP_FAILS}
+    ip_list = [ip for ip in ip_list if ip not in skipped]
+    for ip in skipped:
+        del _probe_failures[ip]
+    
+    # 同一网段的IP是相互独立的主机（端口也常不同），每个IP都要测试；
+    # 网段只用于之后可播放性测试的排序
+    results = await asyncio.gather(*(connect(ip) for ip in ip_list))
+    
+    reachable = set()
+    now = time.time()
+    for ip, (is_open, _) in zip(ip_list, results):
+        if is_open:
+            reachable.add(ip)
+            _probe_failures.pop(ip, None)
+        else:
+            fails = _probe_failures.get(ip, [0])[0]
+            _probe_failures[ip] = [fails + 1, now]
+    
+    print(f"   跳过 {len(skipped)} 个连续多次不通的IP; {len(reachable)}/{len(ip_list)}个IP端口开放")
+    return reachable
+
+async def complete_speed_test_workflow(session: aiohttp.ClientSession, ip_list: List[str], multicast_addr: str) -> List[Dict]:
     """完整的测速工作流"""
     if not ip_list:
         return []
     
-    # 直接使用ffprobe检测流是否可播放（第一个脚本的逻辑）
+    # 按网段轮流排列，优先测试不同网段的IP
+    ip_list = interleave_subnets(group_by_subnet(ip_list))
+    
     print(f"    可播放性测试: {len(ip_list)}个IP")
     playable_results = []
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_ip = {
-            executor.submit(test_stream_playable, ip, multicast_addr): ip 
-            for ip in ip_list[:50]  # 限制测试数量
-        }
-        
+    # 不再截断IP列表：按窗口逐步检测，找够TARGET_HITS个即取消剩余检测
+    # 每个检测最多占用一个ffprobe进程，窗口同时限制了后备进程数
+    semaphore = asyncio.Semaphore(MAX_WORKERS)
+    
+    async def probe(ip: str) -> Optional[Dict]:
+        async with semaphore:
+            return await test_stream_playable(session, ip, multicast_addr)
+    
+    tasks = [asyncio.ensure_future(probe(ip)) for ip in ip_list]
+    
+    try:
         completed = 0
-        for future in concurrent.futures.as_completed(future_to_ip):
+        last_report = time.time()
+        for future in asyncio.as_completed(tasks):
             completed += 1
-            ip = future_to_ip[future]
-            result = future.result()
+            result = await future
             
-            if completed % 10 == 0 or completed == len(future_to_ip):
-                print(f"      进度: {completed}/{len(future_to_ip)}")
+            # 按时间间隔输出进度，输出次数与耗时相关而不是与IP数量相关
+            now = time.time()
+            if now - last_report >= PROGRESS_INTERVAL or completed == len(tasks):
+                print(f"      进度: {completed}/{len(tasks)}")
+                last_report = now
             
             if result:
                 playable_results.append(result)
+                if len(playable_results) >= TARGET_HITS:
+                    print(f"      已找到{TARGET_HITS}个可播放源，提前结束 ({completed}/{len(tasks)})")
+                    break
+    finally:
+        # 取消剩余任务并等待连接关闭、ffprobe进程退出
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     
     print(f"    可播放IP数量: {len(playable_results)}个")
     
@@ -204,95 +658,92 @@ def save_results(results: Dict):
         "sources": results
     }
     
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    json_dump_file(OUTPUT_FILE, output_data, indent=True)
     
     print(f"🎉 结果已保存到 {OUTPUT_FILE}")
     print(f"   总计: {output_data['total_streams']} 个可播放的IPTV源")
 
-def main():
+async def main_async():
     print("🚀 IPTV源检测流程开始")
     print("=" * 60)
     
-    # 步骤1: 从所有仓库收集IP
-    print("📦 从GitHub仓库收集IP文件中...")
+    load_caches()
     
-    ip_collections = defaultdict(set)
-    
-    for repo in REPOS:
-        print(f"\n处理仓库: {repo}")
-        files = fetch_repo_files(repo)
+    async with create_session() as session:
+        # 步骤1: 从所有仓库收集IP
+        print("📦 从GitHub仓库收集IP文件中...")
         
-        if not files:
-            continue
+        ip_collections = defaultdict(set)
         
-        txt_files = [f for f in files if f['type'] == 'file' and f['name'].endswith('.txt')]
+        # 所有仓库并发处理
+        client = GitHubClient(session)
+        repo_results = await asyncio.gather(*(process_repo(client, repo) for repo in REPOS))
         
-        for file_info in txt_files:
-            filename = file_info['name']
-            
-            for province, isp, _, _ in TARGETS:
-                if is_target_match(filename, province, isp):
-                    print(f"  ✅ 匹配到: {filename} -> {province}{isp}")
-                    
-                    ips = extract_ips_from_url(file_info['download_url'])
-                    if ips:
-                        key = (province, isp)
-                        ip_collections[key].update(ips)
-                        print(f"    提取到 {len(ips)} 个IP")
-                    break
-    
-    print(f"\n✅ IP收集完成")
-    print(f"   找到 {len(ip_collections)} 个目标组合")
-    
-    for (province, isp), ips in ip_collections.items():
-        print(f"   {province}{isp}: {len(ips)} 个IP")
-    
-    # 步骤2: 对每个组合进行测试
-    print("\n🧪 开始IP可播放性测试...")
-    final_results = {}
-    
-    for (province, isp), ip_set in ip_collections.items():
-        # 查找对应的组播地址和英文简称
-        target_info = next(((addr, code) for p, i, addr, code in TARGETS if p == province and i == isp), None)
-        if not target_info:
-            print(f"  警告: 未找到 {province}{isp} 的配置，跳过")
-            continue
+        for results in repo_results:
+            for key, ips in results.items():
+                ip_collections[key] |= ips
         
-        multicast, code = target_info
-        ip_list = list(ip_set)
-        print(f"\n  处理 {province}{isp} ({code}): {len(ip_list)}个IP")
+        print(f"\n✅ IP收集完成")
+        print(f"   找到 {len(ip_collections)} 个目标组合")
         
-        if not ip_list:
-            continue
+        for (province, isp), ips in ip_collections.items():
+            print(f"   {province}{isp}: {len(ips)} 个IP")
         
-        playable_results = complete_speed_test_workflow(ip_list, multicast)
+        # 步骤2: 所有组合的IP去重后统一做一次TCP连通性测试
+        all_ips = set().union(*ip_collections.values())
+        print(f"\n🔌 TCP连通性测试: 共 {len(all_ips)} 个不重复IP")
+        reachable = await find_reachable_ips(list(all_ips))
         
-        if playable_results:
-            top_2 = playable_results[:2]
+        # 步骤3: 对每个组合进行可播放性测试
+        print("\n🧪 开始IP可播放性测试...")
+        final_results = {}
+        
+        for (province, isp), ip_set in ip_collections.items():
+            # 查找对应的组播地址和英文简称
+            target_info = TARGET_MAP.get((province, isp))
+            if not target_info:
+                print(f"  警告: 未找到 {province}{isp} 的配置，跳过")
+                continue
             
-            # 使用英文简称作为键
-            final_results[code] = [
-                {
-                    "ip": item['ip_port'],  # 存储ip:port
-                    "multicast": multicast,  # 存储组播地址
-                    "latency_ms": item['latency_ms']
-                }
-                for item in top_2
-            ]
+            multicast, code = target_info
+            ip_list = list(ip_set & reachable)
+            print(f"\n  处理 {province}{isp} ({code}): {len(ip_list)}/{len(ip_set)}个IP端口开放")
             
-            print(f"    ✅ 找到 {len(top_2)} 个可播放源")
-            for i, item in enumerate(top_2, 1):
-                print(f"      第{i}名: 延迟 {item['latency_ms']}ms")
-        else:
-            print(f"    ❌ 没有可播放的IP")
+            if not ip_list:
+                print("    ❌ 没有端口开放的IP")
+                continue
+            
+            playable_results = await complete_speed_test_workflow(session, ip_list, multicast)
+            
+            if playable_results:
+                top_2 = playable_results[:2]
+                
+                # 使用英文简称作为键
+                final_results[code] = [
+                    {
+                        "ip": item['ip_port'],  # 存储ip:port
+                        "multicast": multicast,  # 存储组播地址
+                        "latency_ms": item['latency_ms']
+                    }
+                    for item in top_2
+                ]
+                
+                print(f"    ✅ 找到 {len(top_2)} 个可播放源")
+                for i, item in enumerate(top_2, 1):
+                    print(f"      第{i}名: 延迟 {item['latency_ms']}ms")
+            else:
+                print(f"    ❌ 没有可播放的IP")
     
-    # 步骤3: 保存结果
+    # 步骤4: 保存结果
     save_results(final_results)
+    save_caches()
     
     print("\n" + "=" * 60)
     print("🎉 程序执行完成")
     print("=" * 60)
 
+def main():
+    asyncio.run(main_async())
+
 if __name__ == "__main__":
     main()